@@ -1,4 +1,7 @@
 import pandas as pd
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
 import logging
 from pathlib import Path
 from typing import List, Optional
@@ -15,15 +18,21 @@ class ForwardCitationMatcher:
     3. Citation date ranges and temporal patterns
     """
     
+    # Only these columns of the merged citations are used by the analysis
+    CITATION_COLUMNS = ['citing_patent_id', 'connected_patent_id', 'citation_date', 'citation_type']
+    
     def __init__(self, base_path: Path = Path("Data")):
         """Initialize the matcher with logging setup and base path."""
-        # Setup logging
+        # Setup logging (the module logger is shared, so only attach the
+        # file handler once no matter how many matchers are created)
         self.logger = logging.getLogger(__name__)
-        Path("logs").mkdir(exist_ok=True)
-        handler = logging.FileHandler('logs/forward_matching.log')
-        handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
-        self.logger.addHandler(handler)
+        if not any(isinstance(h, logging.FileHandler) for h in self.logger.handlers):
+            Path("logs").mkdir(exist_ok=True)
+            handler = logging.FileHandler('logs/forward_matching.log')
+            handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+            self.logger.addHandler(handler)
         self.logger.setLevel(logging.INFO)
+        self.logger.propagate = False
         
         self.base_path = base_path
 
@@ -45,7 +54,7 @@ class ForwardCitationMatcher:
                 return False
             
             self.logger.info(f"Loading citations for {company}")    
-            citations_df = pd.read_parquet(citations_file)
+            citations_df = pd.read_parquet(citations_file, columns=self.CITATION_COLUMNS)
             self.logger.info(f"Loaded {len(citations_df)} citations for {company}")
             
             # Generate citation analysis
@@ -54,7 +63,7 @@ class ForwardCitationMatcher:
             # Save the analysis results
             output_file = self.base_path / company / f"{company}_citation_analysis.parquet"
             self.logger.info(f"Saving analysis results for {company}")
-            analysis_df.to_parquet(output_file, index=False)
+            self._write_analysis(analysis_df, output_file)
             
             self.logger.info(f"Completed citation analysis for {company}")
             return True
@@ -63,6 +72,21 @@ class ForwardCitationMatcher:
             self.logger.error(f"Error analyzing citations for {company}: {str(e)}")
             return False
             
+    def _write_analysis(self, analysis_df: pd.DataFrame, output_file: Path) -> None:
+        """
+        Write the analysis results as zstd-compressed Parquet.
+        
+        The constant per-company metadata columns are dictionary encoded;
+        patent_id is unique per row so it is stored plain.
+        """
+        table = pa.Table.from_pandas(analysis_df, preserve_index=False)
+        pq.write_table(
+            table,
+            output_file,
+            compression='zstd',
+            use_dictionary=['company_name', 'processing_date']
+        )
+            
     def _analyze_citations_efficient(self, citations_df: pd.DataFrame, company: str) -> pd.DataFrame:
         """
         Efficiently analyze citation patterns using vectorized operations.
@@ -79,50 +103,44 @@ class ForwardCitationMatcher:
             
             # Calculate backward citations (where patent is citing)
             self.logger.info(f"{company}: Calculating backward citations")
-            backward_counts = citations_df[
-                citations_df['citation_type'] == 'backward'
-            ].groupby('citing_patent_id').size().to_frame('total_backward_citations')
+            citation_type = citations_df['citation_type'].to_numpy()
+            backward_counts = citations_df.loc[
+                citation_type == 'backward', 'citing_patent_id'
+            ].value_counts().rename('total_backward_citations')
             
             # Calculate forward citations (where patent is cited)
             self.logger.info(f"{company}: Calculating forward citations")
-            forward_counts = citations_df[
-                citations_df['citation_type'] == 'forward'
-            ].groupby('connected_patent_id').size().to_frame('total_forward_citations')
+            forward_counts = citations_df.loc[
+                citation_type == 'forward', 'connected_patent_id'
+            ].value_counts().rename('total_forward_citations')
             
             # Get all unique patents
-            all_patents = pd.Index(set(citations_df['citing_patent_id']).union(
-                                 set(citations_df['connected_patent_id'])))
+            all_patents = pd.Index(pd.unique(np.concatenate([
+                citations_df['citing_patent_id'].to_numpy(),
+                citations_df['connected_patent_id'].to_numpy()
+            ])), name='patent_id')
             self.logger.info(f"{company}: Processing {len(all_patents)} unique patents")
             
             # Calculate date ranges for each patent
             self.logger.info(f"{company}: Calculating date ranges")
-            date_ranges = citations_df.groupby('citing_patent_id').agg({
-                'citation_date': ['min', 'max']
-            })
-            date_ranges.columns = ['earliest_citation', 'latest_citation']
+            date_ranges = citations_df.groupby(
+                'citing_patent_id', sort=False
+            )['citation_date'].agg(earliest_citation='min', latest_citation='max')
             
-            # Create base DataFrame with all patents
-            results = pd.DataFrame(index=all_patents)
-            results.index.name = 'patent_id'
-            results = results.reset_index()
-            
-            # Join all the data
+            # Build the result column-wise from typed arrays aligned on the
+            # patent index; missing citation counts become 0
             self.logger.info(f"{company}: Combining results")
-            results = results.merge(
-                backward_counts, left_on='patent_id', right_index=True, how='left'
-            ).merge(
-                forward_counts, left_on='patent_id', right_index=True, how='left'
-            ).merge(
-                date_ranges, left_on='patent_id', right_index=True, how='left'
-            )
-            
-            # Fill NaN values with 0 for citation counts
-            results['total_backward_citations'] = results['total_backward_citations'].fillna(0)
-            results['total_forward_citations'] = results['total_forward_citations'].fillna(0)
-            
-            # Add metadata
-            results['company_name'] = company
-            results['processing_date'] = datetime.now().strftime('%Y-%m-%d')
+            results = pd.DataFrame({
+                'patent_id': all_patents.to_numpy(),
+                'total_backward_citations': backward_counts.reindex(
+                    all_patents, fill_value=0).to_numpy(dtype=np.int32),
+                'total_forward_citations': forward_counts.reindex(
+                    all_patents, fill_value=0).to_numpy(dtype=np.int32),
+                'earliest_citation': date_ranges['earliest_citation'].reindex(all_patents).to_numpy(),
+                'latest_citation': date_ranges['latest_citation'].reindex(all_patents).to_numpy(),
+                'company_name': company,
+                'processing_date': datetime.now().strftime('%Y-%m-%d')
+            })
             
             return results
             
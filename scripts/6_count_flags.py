@@ -1,12 +1,18 @@
 import pandas as pd
 import numpy as np
-import logging
+import pyarrow.parquet as pq
+import argparse
+import os
+from functools import partial
 from pathlib import Path
-from typing import Dict, List, Optional, Tuple
-import json
+from typing import Dict, List, Optional
 from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from tqdm import tqdm
 
+from pipeline_utils import (configure_logging, init_worker, load_json, run_company, save_json,
+                            up_to_date)
+
 class FlagCounter:
     """
     Enhanced citation analysis and flag counting system.
@@ -18,16 +24,22 @@ class FlagCounter:
     4. Citation quality indicators
     """
     
-    def __init__(self, base_path: Path = Path("Data")):
-        """Initialize with logging and paths."""
-        self.logger = logging.getLogger(__name__)
-        Path("logs").mkdir(exist_ok=True)
-        handler = logging.FileHandler('logs/flag_counting.log')
-        handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
-        self.logger.addHandler(handler)
-        self.logger.setLevel(logging.INFO)
+    # Columns of the merged citations used by the analysis
+    CITATION_COLUMNS = ['citing_patent_id', 'connected_patent_id', 'citation_date']
+    
+    NS_PER_DAY = 86_400 * 1_000_000_000
+    
+    def __init__(self, base_path: Path = Path("Data"), force: bool = False):
+        """
+        Initialize with logging and paths.
+        
+        Unless force is set, companies whose citation_analysis.json is at
+        least as new as their merged citations are not reprocessed.
+        """
+        self.logger = configure_logging(__name__, 'logs/flag_counting.log')
         
         self.base_path = base_path
+        self.force = force
 
     def process_company_flags(self, company: str) -> Optional[Dict]:
         """Process citation flags and generate detailed metrics."""
@@ -37,26 +49,59 @@ class FlagCounter:
             if not input_file.exists():
                 self.logger.error(f"Merged citations file not found: {input_file}")
                 return None
+            
+            # Skip companies already analysed since their citations last changed
+            output_file = self.base_path / company / "citation_analysis.json"
+            if not self.force and up_to_date(output_file, [input_file]):
+                self.logger.info(f"Citation analysis for {company} is up to date, skipping")
+                return load_json(output_file)
                 
             self.logger.info(f"Processing flags for {company}")
-            citations_df = pd.read_parquet(input_file)
+            # Read the patent ids straight into dictionary arrays (categoricals
+            # in pandas) so the per-year unique counts hash integer codes
+            # rather than Python strings
+            citations_df = pq.read_table(
+                input_file,
+                columns=self.CITATION_COLUMNS,
+                read_dictionary=['citing_patent_id', 'connected_patent_id']
+            ).to_pandas()
+            
+            # Convert citation_date to datetime once (the upstream steps usually
+            # store it typed already) and extract year; unparseable dates raise
+            # (format='ISO8601' needs pandas >= 2.0)
+            if not pd.api.types.is_datetime64_any_dtype(citations_df['citation_date']):
+                citations_df['citation_date'] = pd.to_datetime(
+                    citations_df['citation_date'], format='ISO8601', cache=True
+                )
+            citations_df['citation_year'] = citations_df['citation_date'].dt.year.astype('Int32')
             
-            # Convert citation_date to datetime and extract year
-            citations_df['citation_date'] = pd.to_datetime(citations_df['citation_date'])
-            citations_df['citation_year'] = citations_df['citation_date'].dt.year
+            # Process citations by year, partitioning the frame once rather
+            # than re-scanning it with a boolean mask for every year
+            by_year = citations_df.groupby('citation_year', sort=False)
             
-            # Process citations by year
+            # Basic citation counts and date spans for all years in a single
+            # aggregation; k5 is then scored for every year at once
+            year_stats = by_year.agg(
+                total_citations=('citing_patent_id', 'size'),
+                unique_citing_patents=('citing_patent_id', 'nunique'),
+                unique_cited_patents=('connected_patent_id', 'nunique'),
+                first_citation=('citation_date', 'min'),
+                last_citation=('citation_date', 'max')
+            )
+            year_stats['k5_diversity'] = self._calculate_k5_diversity(year_stats)
+            basic_counts = year_stats.to_dict('index')
+            
+            processing_date = datetime.now().strftime('%Y-%m-%d')
             yearly_results = {}
-            for year in citations_df['citation_year'].unique():
-                year_df = citations_df[citations_df['citation_year'] == year]
-                year_summary = self._process_year_citations(year_df, company, year)
+            for year, year_df in by_year:
+                year_summary = self._process_year_citations(
+                    year_df, company, int(year), basic_counts[year], processing_date
+                )
                 if year_summary:
-                    yearly_results[str(int(year))] = year_summary
+                    yearly_results[str(year_summary['year'])] = year_summary
             
             # Save results
-            output_file = self.base_path / company / "citation_analysis.json"
-            with open(output_file, 'w') as f:
-                json.dump(yearly_results, f, indent=2)
+            save_json(yearly_results, output_file, pretty=True)
             
             return yearly_results
             
@@ -64,88 +109,93 @@ class FlagCounter:
             self.logger.error(f"Error processing flags for {company}: {str(e)}")
             return None
 
-    def _process_year_citations(self, df: pd.DataFrame, company: str, year: int) -> Dict:
-        """Process citations for a specific year with enhanced metrics."""
+    def _process_year_citations(self, df: pd.DataFrame, company: str, year: int,
+                                basic_counts: Dict, processing_date: str) -> Dict:
+        """
+        Process citations for a specific year with enhanced metrics.
+        
+        basic_counts holds the year's total_citations, unique_citing_patents,
+        unique_cited_patents and k5_diversity, aggregated for all years at
+        once by the caller.
+        processing_date is computed once per company run.
+        """
         try:
-            # Basic citation counts
-            total_citations = len(df)
-            unique_citing_patents = df['citing_patent_id'].nunique()
-            unique_cited_patents = df['connected_patent_id'].nunique()
+            # Basic citation counts, reused by all helpers below
+            basic_metrics = {
+                'total_citations': int(basic_counts['total_citations']),
+                'unique_citing_patents': int(basic_counts['unique_citing_patents']),
+                'unique_cited_patents': int(basic_counts['unique_cited_patents'])
+            }
             
             # Citation analysis
-            citation_metrics = self._analyze_self_citations(df, company)
+            citation_metrics = self._analyze_self_citations(basic_metrics, company)
             
             # Temporal analysis
-            temporal_metrics = self._analyze_temporal_patterns(df)
+            temporal_metrics = self._analyze_temporal_patterns()
             
             # Network position metrics
-            network_metrics = self._calculate_network_metrics(df)
+            network_metrics = self._calculate_network_metrics(basic_metrics, basic_counts['k5_diversity'])
             
             return {
                 'company_name': company,
-                'year': int(year),
-                'basic_metrics': {
-                    'total_citations': total_citations,
-                    'unique_citing_patents': unique_citing_patents,
-                    'unique_cited_patents': unique_cited_patents
-                },
+                'year': year,
+                'basic_metrics': basic_metrics,
                 'citation_metrics': citation_metrics,
                 'temporal_metrics': temporal_metrics,
                 'network_metrics': network_metrics,
-                'processing_date': datetime.now().strftime('%Y-%m-%d')
+                'processing_date': processing_date
             }
             
         except Exception as e:
             self.logger.error(f"Error processing year {year} for {company}: {str(e)}")
             return None
 
-    def _analyze_self_citations(self, df: pd.DataFrame, company: str) -> Dict:
+    def _analyze_self_citations(self, basic_metrics: Dict, company: str) -> Dict:
         """
         Analyze self-citation patterns based on patent ownership.
         A self-citation is when a patent cites another patent from the same company.
         """
         # For now, we'll just return basic citation counts since we don't have company data
-        total_citations = len(df)
+        total_citations = basic_metrics['total_citations']
+        unique_citing = basic_metrics['unique_citing_patents']
         
         return {
-            'total_citations': int(total_citations),
-            'citation_density': float(total_citations / df['citing_patent_id'].nunique() 
-                                    if df['citing_patent_id'].nunique() > 0 else 0)
+            'total_citations': total_citations,
+            'citation_density': float(total_citations / unique_citing 
+                                    if unique_citing > 0 else 0)
         }
 
-    def _analyze_temporal_patterns(self, df: pd.DataFrame) -> Dict:
-        """Analyze citation temporal patterns."""
-        try:
-            df['citation_lag'] = (df['citation_date'] - 
-                                pd.to_datetime(df['patent_date'])).dt.days / 365.25
-            
-            return {
-                'mean_citation_lag': float(df['citation_lag'].mean()),
-                'median_citation_lag': float(df['citation_lag'].median()),
-                'citation_age_distribution': self._calculate_age_distribution(df)
-            }
-        except Exception as e:
-            # If we can't calculate temporal patterns, return basic structure
-            return {
-                'mean_citation_lag': 0.0,
-                'median_citation_lag': 0.0,
-                'citation_age_distribution': {}
-            }
+    def _analyze_temporal_patterns(self) -> Dict:
+        """
+        Analyze citation temporal patterns.
+        
+        Citation lags and age distributions are not computed yet, so this
+        returns the basic structure with zero lags. Pure F's temporal factor
+        and DI's i5 are derived from mean_citation_lag, so filling these in
+        changes every published Pure F, DI and mDI score.
+        """
+        return {
+            'mean_citation_lag': 0.0,
+            'median_citation_lag': 0.0,
+            'citation_age_distribution': {}
+        }
 
-    def _calculate_network_metrics(self, df: pd.DataFrame) -> Dict:
-        """Calculate citation network position metrics including k5 diversity."""
+    def _calculate_network_metrics(self, basic_metrics: Dict, k5_score: float) -> Dict:
+        """
+        Calculate citation network position metrics including k5 diversity.
+        
+        k5_score is the year's diversity score from _calculate_k5_diversity.
+        """
         try:
             # Basic network metrics
-            forward_connections = df['citing_patent_id'].nunique()
-            backward_connections = df['connected_patent_id'].nunique()
-            
-            # Calculate k5 (technological diversity)
-            k5_score = self._calculate_k5_diversity(df)
+            forward_connections = basic_metrics['unique_citing_patents']
+            backward_connections = basic_metrics['unique_cited_patents']
+            total_citations = basic_metrics['total_citations']
             
             return {
                 'forward_connections': int(forward_connections),
                 'backward_connections': int(backward_connections),
-                'network_density': float(len(df) / (forward_connections * backward_connections) 
+                'network_density': float(total_citations / (forward_connections * backward_connections) 
                                       if forward_connections * backward_connections > 0 else 0),
                 'k5_diversity': float(k5_score)
             }
@@ -157,41 +207,43 @@ class FlagCounter:
                 'k5_diversity': 0.0
             }
 
-    def _calculate_k5_diversity(self, df: pd.DataFrame) -> float:
+    def _calculate_k5_diversity(self, year_stats: pd.DataFrame) -> pd.Series:
         """
-        Calculate k5 diversity score based on citation patterns.
+        Calculate k5 diversity scores for all years based on citation patterns.
         
         k5 measures the technological diversity of citations using:
         1. Patent class distribution
         2. Citation network spread
-        3. Temporal distribution
+        3. Temporal distribution (citation date span, normalized to 5 years)
+        
+        year_stats is the per-year aggregate built in process_company_flags.
         """
-        try:
-            # Get unique patents and their connections
-            unique_citing = df['citing_patent_id'].nunique()
-            unique_cited = df['connected_patent_id'].nunique()
-            total_connections = len(df)
-            
-            if unique_citing == 0 or unique_cited == 0:
-                return 0.0
-            
-            # Calculate diversity metrics
+        unique_citing = year_stats['unique_citing_patents'].to_numpy(dtype=np.float64)
+        unique_cited = year_stats['unique_cited_patents'].to_numpy(dtype=np.float64)
+        total_connections = year_stats['total_citations'].to_numpy(dtype=np.float64)
+        # Citation date span in whole days (as Timedelta.days), computed on the
+        # raw int64 nanoseconds rather than through a Timedelta series
+        span_ns = (year_stats['last_citation'].to_numpy(dtype='datetime64[ns]').view('i8') -
+                   year_stats['first_citation'].to_numpy(dtype='datetime64[ns]').view('i8'))
+        date_range = (span_ns // self.NS_PER_DAY) / 365.25
+        
+        # Calculate diversity metrics; years without citing or cited
+        # patents score 0 below
+        with np.errstate(divide='ignore', invalid='ignore'):
             connection_ratio = total_connections / (unique_citing * unique_cited)
-            patent_ratio = min(unique_citing, unique_cited) / max(unique_citing, unique_cited)
-            
-            # Temporal spread (normalized to 5-year window)
-            date_range = (df['citation_date'].max() - df['citation_date'].min()).days / 365.25
-            temporal_factor = min(1.0, date_range / 5.0)
-            
-            # Combine factors (weighted average)
-            k5_score = (0.4 * connection_ratio + 
-                       0.4 * patent_ratio + 
-                       0.2 * temporal_factor)
-            
-            return min(1.0, k5_score)
-            
-        except Exception as e:
-            return 0.0
+            patent_ratio = (np.minimum(unique_citing, unique_cited) /
+                            np.maximum(unique_citing, unique_cited))
+        
+        # Temporal spread (normalized to 5-year window)
+        temporal_factor = np.fmin(1.0, date_range / 5.0)
+        
+        # Combine factors (weighted average)
+        k5_score = np.fmin(1.0, 0.4 * connection_ratio +
+                                0.4 * patent_ratio +
+                                0.2 * temporal_factor)
+        k5_score = np.where((unique_citing == 0) | (unique_cited == 0), 0.0, k5_score)
+        
+        return pd.Series(k5_score, index=year_stats.index)
 
 def main():
     """
@@ -199,12 +251,21 @@ def main():
     
     The function:
     1. Initializes FlagCounter instance
-    2. Processes each company in the Data directory
+    2. Processes the companies in the Data directory in parallel, one
+       company per task across a pool of worker processes
     3. Tracks success/failure statistics
     4. Prints processing summary
+    
+    Companies with an up-to-date citation_analysis.json are skipped unless
+    --force is given.
     """
+    parser = argparse.ArgumentParser(description="Count citation flags and analysis metrics")
+    parser.add_argument('--force', action='store_true',
+                        help="reprocess companies even if their analysis is up to date")
+    args = parser.parse_args()
+    
     # Initialize counter with default Data path
-    counter = FlagCounter()
+    counter = FlagCounter(force=args.force)
     
     # Get list of companies (directories in Data path)
     companies = [d.name for d in counter.base_path.iterdir() 
@@ -215,14 +276,22 @@ def main():
     successful = []
     failed = []
     
-    # Process each company
-    for company in tqdm(companies):
-        if counter.process_company_flags(company):
-            successful.append(company)
-            print(f"Successfully processed {company}")
-        else:
-            failed.append(company)
-            print(f"Failed to process {company}")
+    # Process companies in parallel with one FlagCounter per worker; each
+    # company is fully independent
+    process_company = partial(run_company, 'process_company_flags')
+    with ProcessPoolExecutor(max_workers=os.cpu_count(),
+                             initializer=init_worker,
+                             initargs=(FlagCounter, {'base_path': counter.base_path,
+                                                     'force': counter.force})) as executor:
+        futures = [executor.submit(process_company, company) for company in companies]
+        for future in tqdm(as_completed(futures), total=len(futures)):
+            company, results = future.result()
+            if results:
+                successful.append(company)
+                print(f"Successfully processed {company}")
+            else:
+                failed.append(company)
+                print(f"Failed to process {company}")
     
     # Print summary
     print(f"\nProcessing Summary")
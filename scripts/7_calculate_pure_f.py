@@ -1,11 +1,19 @@
 import pandas as pd
-import logging
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+import argparse
+import os
+from functools import partial
 from pathlib import Path
 from typing import Dict, List, Optional
-import json
 from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from tqdm import tqdm
 
+from pipeline_utils import (configure_logging, init_worker, list_companies, load_json,
+                            run_company, save_json, up_to_date)
+
 class PureFCalculator:
     """
     Enhanced Pure F score calculator with temporal and network adjustments.
@@ -17,160 +25,231 @@ class PureFCalculator:
     4. Citation quality factors
     """
     
-    def __init__(self, base_path: Path = Path("Data")):
+    # Per-year inputs read from citation_analysis.json, laid out as columns so
+    # that all years of a company are scored in one vectorized pass
+    INPUT_COLUMNS = ['year', 'total_citations', 'unique_citing_patents', 'unique_cited_patents',
+                     'mean_citation_lag', 'network_density']
+    
+    # Metric sections and basic counts every year must carry to be scored
+    REQUIRED_SECTIONS = ['basic_metrics', 'temporal_metrics', 'network_metrics']
+    REQUIRED_BASIC_METRICS = ['total_citations', 'unique_citing_patents', 'unique_cited_patents']
+    
+    # Columns of the Pure F panel written by write_panel, in output order
+    PANEL_COLUMNS = ['company_name', 'year', 'pure_f_score', 'temporal_factor', 'network_factor',
+                     'quality_factor', 'total_citations', 'unique_citing_patents',
+                     'unique_cited_patents']
+    
+    def __init__(self, base_path: Path = Path("Data"), force: bool = False,
+                 pretty: bool = False):
         # Setup logging
-        self.logger = logging.getLogger(__name__)
-        Path("logs").mkdir(exist_ok=True)
-        handler = logging.FileHandler('logs/pure_f_calculation.log')
-        handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
-        self.logger.addHandler(handler)
-        self.logger.setLevel(logging.INFO)
+        self.logger = configure_logging(__name__, 'logs/pure_f_calculation.log')
         
         self.base_path = base_path
+        
+        # Recompute companies even when their results are newer than the inputs
+        self.force = force
+        
+        # Indent the JSON output (compact by default)
+        self.pretty = pretty
+        
+        # Processing date stamped on every result of this run
+        self._today = datetime.now().strftime('%Y-%m-%d')
 
     def calculate_company_pure_f(self, company: str) -> Optional[Dict]:
         """Calculate enhanced Pure F scores for a company."""
         try:
             # Load citation analysis data
-            analysis_file = self.base_path / company / "citation_analysis.json"
+            company_dir = self.base_path / company
+            analysis_file = company_dir / "citation_analysis.json"
             if not analysis_file.exists():
-                self.logger.error(f"Citation analysis file not found for {company}")
+                self.logger.error("Citation analysis file not found for %s", company)
                 return None
 
-            with open(analysis_file, 'r') as f:
-                citation_data = json.load(f)
+            # Reuse results that are newer than the citation analysis
+            output_file = company_dir / "pure_f_summary.json"
+            if not self.force and up_to_date(output_file, [analysis_file]):
+                self.logger.info("Pure F for %s is up to date, skipping", company)
+                return load_json(output_file)
 
-            # Calculate Pure F scores by year
+            citation_data = load_json(analysis_file)
+
+            # Calculate Pure F scores for all years at once
+            scores = self._calculate_pure_f_scores(citation_data, company)
+            
             yearly_results = {}
-            for year, year_data in citation_data.items():
-                self.logger.info(f"Processing year {year} for {company}")
-                
-                year_pure_f = self._calculate_year_pure_f(year_data, company, int(year))
-                if year_pure_f:
-                    yearly_results[year] = year_pure_f
+            # to_dict yields native Python ints/floats, ready for serialization
+            for row in scores.to_dict('records'):
+                yearly_results[str(row['year'])] = {
+                    'company_name': company,
+                    'year': row['year'],
+                    'pure_f_score': row['pure_f_score'],
+                    'components': {
+                        'temporal_factor': row['temporal_factor'],
+                        'network_factor': row['network_factor'],
+                        'quality_factor': row['quality_factor']
+                    },
+                    'metrics': {
+                        'total_citations': row['total_citations'],
+                        'unique_citing_patents': row['unique_citing_patents'],
+                        'unique_cited_patents': row['unique_cited_patents']
+                    },
+                    'processing_date': self._today
+                }
 
             if not yearly_results:
-                self.logger.error(f"No valid Pure F results calculated for {company}")
+                self.logger.error("No valid Pure F results calculated for %s", company)
                 return None
 
             # Save results
-            output_file = self.base_path / company / "pure_f_summary.json"
-            with open(output_file, 'w') as f:
-                json.dump(yearly_results, f, indent=2)
+            save_json(yearly_results, output_file, pretty=self.pretty)
 
             return yearly_results
 
         except Exception as e:
-            self.logger.error(f"Error calculating Pure F for {company}: {str(e)}")
+            self.logger.error("Error calculating Pure F for %s: %s", company, e)
             return None
 
-    def _calculate_year_pure_f(self, year_data: Dict, company: str, year: int) -> Optional[Dict]:
+    def write_panel(self, all_results: Dict[str, Dict], output_file: Optional[Path] = None) -> None:
         """
-        Calculate Pure F score for a specific year with enhanced metrics.
+        Write every company's yearly Pure F results to one Parquet panel.
         
-        New formula:
-        Pure F = (Base Match Rate) * (Temporal Factor) * (Network Factor) * (Quality Factor)
+        Defaults to Data/pure_f_panel.parquet, from which the DI step reads
+        Pure F scores instead of opening each company's pure_f_summary.json.
         """
-        try:
-            # Extract metrics from year_data
-            basic_metrics = year_data['basic_metrics']
-            temporal_metrics = year_data['temporal_metrics']
-            network_metrics = year_data['network_metrics']
-            
-            # Calculate base match rate
-            total_citations = basic_metrics['total_citations']
-            if total_citations == 0:
-                return None
-                
-            # Calculate temporal factor (weight recent citations higher)
-            temporal_factor = self._calculate_temporal_factor(temporal_metrics)
-            
-            # Calculate network factor
-            network_factor = self._calculate_network_factor(network_metrics)
-            
-            # Calculate quality factor
-            quality_factor = self._calculate_quality_factor(basic_metrics)
-            
-            # Calculate final Pure F score
-            pure_f_score = temporal_factor * network_factor * quality_factor
-            
-            return {
-                'company_name': company,
-                'year': year,
-                'pure_f_score': float(pure_f_score),
-                'components': {
-                    'temporal_factor': float(temporal_factor),
-                    'network_factor': float(network_factor),
-                    'quality_factor': float(quality_factor)
-                },
-                'metrics': {
-                    'total_citations': total_citations,
-                    'unique_citing_patents': basic_metrics['unique_citing_patents'],
-                    'unique_cited_patents': basic_metrics['unique_cited_patents']
-                },
-                'processing_date': datetime.now().strftime('%Y-%m-%d')
-            }
+        output_file = output_file or self.base_path / "pure_f_panel.parquet"
+        rows = []
+        for company, yearly_results in all_results.items():
+            for year_data in yearly_results.values():
+                components = year_data['components']
+                metrics = year_data['metrics']
+                rows.append((
+                    company,
+                    year_data['year'],
+                    year_data['pure_f_score'],
+                    components['temporal_factor'],
+                    components['network_factor'],
+                    components['quality_factor'],
+                    metrics['total_citations'],
+                    metrics['unique_citing_patents'],
+                    metrics['unique_cited_patents']
+                ))
+        
+        df = pd.DataFrame.from_records(rows, columns=self.PANEL_COLUMNS)
+        pq.write_table(
+            pa.Table.from_pandas(df, preserve_index=False),
+            output_file,
+            compression='zstd',
+            use_dictionary=['company_name']
+        )
+        self.logger.info("Wrote Pure F panel with %d observations to %s", len(df), output_file)
 
-        except Exception as e:
-            self.logger.error(f"Error calculating year {year} Pure F for {company}: {str(e)}")
-            return None
+    def _calculate_pure_f_scores(self, citation_data: Dict, company: str) -> pd.DataFrame:
+        """
+        Calculate Pure F scores for all years of a company in one vectorized pass.
+        
+        Formula:
+        Pure F = (Temporal Factor) * (Network Factor) * (Quality Factor)
+        
+        Years without citations are dropped; malformed years are logged and skipped.
+        """
+        records = []
+        for year, year_data in citation_data.items():
+            basic_metrics = year_data.get('basic_metrics', {})
+            missing = ([k for k in self.REQUIRED_SECTIONS if k not in year_data] +
+                       [k for k in self.REQUIRED_BASIC_METRICS if k not in basic_metrics])
+            if missing:
+                self.logger.error("Skipping year %s Pure F for %s: missing %s",
+                                  year, company, ', '.join(missing))
+                continue
+            records.append((
+                int(year),
+                basic_metrics['total_citations'],
+                basic_metrics['unique_citing_patents'],
+                basic_metrics['unique_cited_patents'],
+                year_data['temporal_metrics'].get('mean_citation_lag', 0),
+                year_data['network_metrics'].get('network_density', 0)
+            ))
+        
+        df = pd.DataFrame.from_records(records, columns=self.INPUT_COLUMNS)
+        df = df[df['total_citations'] != 0]
+        
+        temporal_factor = self._calculate_temporal_factor(
+            df['mean_citation_lag'].to_numpy(dtype=np.float64))
+        network_factor = self._calculate_network_factor(
+            df['network_density'].to_numpy(dtype=np.float64))
+        quality_factor = self._calculate_quality_factor(
+            df['total_citations'].to_numpy(dtype=np.float64),
+            df['unique_citing_patents'].to_numpy(dtype=np.float64),
+            df['unique_cited_patents'].to_numpy(dtype=np.float64))
+        
+        return df.assign(
+            temporal_factor=temporal_factor,
+            network_factor=network_factor,
+            quality_factor=quality_factor,
+            pure_f_score=temporal_factor * network_factor * quality_factor
+        )
 
-    def _calculate_temporal_factor(self, temporal_metrics: Dict) -> float:
+    def _calculate_temporal_factor(self, mean_lag: np.ndarray) -> np.ndarray:
         """Calculate temporal weighting factor."""
-        try:
-            # Weight recent citations higher
-            mean_lag = temporal_metrics.get('mean_citation_lag', 0)
-            if mean_lag > 0:
-                return 1.0 / (1.0 + mean_lag/10.0)  # Decay factor for older citations
-            return 1.0
-        except:
-            return 1.0
-
-    def _calculate_network_factor(self, network_metrics: Dict) -> float:
+        # Weight recent citations higher (decay factor for older citations)
+        return np.where(mean_lag > 0, 1.0 / (1.0 + mean_lag / 10.0), 1.0)
+
+    def _calculate_network_factor(self, density: np.ndarray) -> np.ndarray:
         """Calculate network position factor."""
-        try:
-            # Consider network density and connectivity
-            density = network_metrics.get('network_density', 0)
-            return min(1.0, 0.5 + density)  # Scale density to 0.5-1.0 range
-        except:
-            return 1.0
+        # Scale network density to 0.5-1.0 range
+        return np.minimum(1.0, 0.5 + density)
 
-    def _calculate_quality_factor(self, basic_metrics: Dict) -> float:
+    def _calculate_quality_factor(self, total_citations: np.ndarray, citing_patents: np.ndarray,
+                                  cited_patents: np.ndarray) -> np.ndarray:
         """Calculate citation quality factor."""
-        try:
-            # Consider citation density and diversity
-            citing_patents = basic_metrics.get('unique_citing_patents', 0)
-            cited_patents = basic_metrics.get('unique_cited_patents', 0)
-            total_citations = basic_metrics.get('total_citations', 0)
-            
-            if citing_patents > 0 and cited_patents > 0:
-                diversity = min(citing_patents, cited_patents) / max(citing_patents, cited_patents)
-                density = total_citations / (citing_patents * cited_patents)
-                return (diversity + density) / 2
-            return 0.5
-        except:
-            return 0.5
+        # Consider citation density and diversity; 0.5 without citing/cited patents
+        with np.errstate(divide='ignore', invalid='ignore'):
+            diversity = np.minimum(citing_patents, cited_patents) / np.maximum(citing_patents, cited_patents)
+            density = total_citations / (citing_patents * cited_patents)
+        return np.where((citing_patents > 0) & (cited_patents > 0), (diversity + density) / 2, 0.5)
 
 def main():
-    """Process all companies and calculate Pure F scores."""
-    calculator = PureFCalculator()
+    """
+    Process all companies and calculate Pure F scores.
+    
+    Companies whose pure_f_summary.json is at least as new as their citation
+    analysis are skipped unless --force is given.
+    """
+    parser = argparse.ArgumentParser(description="Calculate Pure F scores")
+    parser.add_argument('--force', action='store_true',
+                        help="recalculate companies even if their results are up to date")
+    parser.add_argument('--pretty', action='store_true',
+                        help="indent the JSON output for reading")
+    args = parser.parse_args()
+    
+    calculator = PureFCalculator(force=args.force, pretty=args.pretty)
     
     # Get list of companies
-    companies = [d.name for d in calculator.base_path.iterdir() 
-                if d.is_dir() and not d.name.startswith('.')
-                and d.name not in ['backup', 'summary']]
+    companies = list_companies(calculator.base_path)
     
     print(f"Processing {len(companies)} companies...")
     successful = []
     failed = []
+    all_results = {}
     
-    for company in tqdm(companies):
-        if calculator.calculate_company_pure_f(company):
-            successful.append(company)
-            print(f"Successfully processed {company}")
-        else:
-            failed.append(company)
-            print(f"Failed to process {company}")
+    # Process companies in parallel with one PureFCalculator per worker; each
+    # company is fully independent
+    process_company = partial(run_company, 'calculate_company_pure_f')
+    with ProcessPoolExecutor(max_workers=os.cpu_count(),
+                             initializer=init_worker,
+                             initargs=(PureFCalculator, {'base_path': calculator.base_path,
+                                                         'force': calculator.force,
+                                                         'pretty': calculator.pretty})) as executor:
+        futures = [executor.submit(process_company, company) for company in companies]
+        for future in tqdm(as_completed(futures), total=len(futures)):
+            company, results = future.result()
+            if results:
+                successful.append(company)
+                all_results[company] = results
+                print(f"Successfully processed {company}")
+            else:
+                failed.append(company)
+                print(f"Failed to process {company}")
     
     print(f"\nPure F Calculation Summary")
     print("=" * 50)
@@ -181,6 +260,9 @@ def main():
         print("\nFailed companies:")
         for company in failed:
             print(f"- {company}")
+    
+    # Collect all companies' scores into one columnar file for the DI step
+    calculator.write_panel(all_results)
 
 if __name__ == "__main__":
     main()
@@ -1,12 +1,24 @@
 import pandas as pd
 import numpy as np
+import pyarrow as pa
+import pyarrow.csv as pacsv
+import pyarrow.parquet as pq
+import argparse
 import logging
+import multiprocessing
+import os
+from functools import partial
+from logging.handlers import QueueListener
 from pathlib import Path
 from typing import Dict, List, Optional
 import json
 from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from tqdm import tqdm
 
+from pipeline_utils import (configure_logging, init_worker, list_companies, load_json,
+                            run_company, save_json, up_to_date)
+
 class DisruptionIndexCalculator:
     """
     Calculate Disruption Index (DI) from Pure F scores and citation metrics.
@@ -25,241 +37,351 @@ class DisruptionIndexCalculator:
         base_path: Base directory path for data files
     """
     
-    def __init__(self, schema_path: Path = None):
+    # Per-year inputs read from citation_analysis.json and pure_f_summary.json,
+    # laid out as columns so that all years of a company are scored at once
+    INPUT_COLUMNS = ['year', 'total_citations', 'unique_citing_patents', 'mean_citation_lag',
+                     'k5_diversity', 'network_density', 'pure_f_score']
+    
+    # Metric sections every year of citation_analysis.json must carry to be scored
+    REQUIRED_SECTIONS = ['basic_metrics', 'temporal_metrics', 'network_metrics']
+    
+    # Columns of the panel dataset, in output order
+    PANEL_COLUMNS = ['company_name', 'year', 'disruption_index', 'modified_disruption_index',
+                     'j5_score', 'i5_score', 'k5_score', 'pure_f_score', 'total_citations',
+                     'network_density']
+    
+    def __init__(self, schema_path: Path = None, force: bool = False, pretty: bool = False,
+                 debug: bool = False):
         # Setup logging
-        self.logger = logging.getLogger(__name__)
-        handler = logging.FileHandler('logs/disruption_index.log')
-        handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
-        self.logger.addHandler(handler)
-        self.logger.setLevel(logging.INFO)
+        self.logger = configure_logging(__name__, 'logs/disruption_index.log')
         
         # Load schema
         if schema_path:
-            with open(schema_path) as f:
-                self.schema = json.load(f)
+            self.schema = load_json(Path(schema_path))
         
         self.base_path = Path(self.schema['config']['base_path']) if schema_path else Path('Data')
         
+        # Recompute companies even when their results are newer than the inputs
+        self.force = force
+        
+        # Indent the JSON output (compact by default)
+        self.pretty = pretty
+        
+        # Print each company's first-year input structures while processing
+        self.debug = debug
+        
+        # Pure F scores by company and year from the Pure F step's panel, if written
+        self._pure_f_panel_file = self.base_path / "pure_f_panel.parquet"
+        self._pure_f_panel = self._load_pure_f_panel()
+        
+        # Processing date stamped on every result of this run
+        self._today = datetime.now().strftime('%Y-%m-%d')
+        
     def calculate_company_di(self, company: str) -> Optional[Dict]:
         """Calculate Disruption Index for a company."""
         try:
             # Load citation analysis data
-            analysis_file = self.base_path / company / "citation_analysis.json"
-            pure_f_file = self.base_path / company / "pure_f_summary.json"
+            company_dir = self.base_path / company
+            analysis_file = company_dir / "citation_analysis.json"
+            pure_f_file = company_dir / "pure_f_summary.json"
             
             if not analysis_file.exists() or not pure_f_file.exists():
-                self.logger.error(f"Required files not found for {company}")
+                self.logger.error("Required files not found for %s", company)
                 return None
 
-            with open(analysis_file, 'r') as f:
-                citation_data = json.load(f)
+            # Reuse results that are newer than both inputs
+            output_file = company_dir / "disruption_index.json"
+            if not self.force and up_to_date(output_file, [analysis_file, pure_f_file]):
+                self.logger.info("DI for %s is up to date, skipping", company)
+                return load_json(output_file)
 
-            with open(pure_f_file, 'r') as f:
-                pure_f_data = json.load(f)
+            citation_data = load_json(analysis_file)
+            # The panel is only trusted when it is at least as new as the
+            # company's own Pure F results (a single company may have been rerun)
+            if (self._pure_f_panel is not None and company in self._pure_f_panel
+                    and up_to_date(self._pure_f_panel_file, [pure_f_file])):
+                pure_f_data = self._pure_f_panel[company]
+            else:
+                pure_f_data = load_json(pure_f_file)
             
-            # Debug: print first year data structure
-            first_year = list(citation_data.keys())[0]
-            print(f"\nProcessing {company} - Year {first_year}")
-            print(f"Citation data structure: {json.dumps(citation_data[first_year], indent=2)}")
-            print(f"Pure F data structure: {json.dumps(pure_f_data[first_year], indent=2)}")
+            # Debug: print first year data structure (from pure_f_summary.json,
+            # since panel entries carry only the score)
+            if self.debug:
+                first_year = next(iter(citation_data))
+                pure_f_summary = load_json(pure_f_file)
+                print(f"\nProcessing {company} - Year {first_year}")
+                print(f"Citation data structure: {json.dumps(citation_data[first_year], indent=2)}")
+                print(f"Pure F data structure: {json.dumps(pure_f_summary.get(first_year), indent=2)}")
 
-            # Calculate DI by year
+            # Calculate DI for all years at once
+            scores = self._calculate_di_scores(citation_data, pure_f_data, company)
+            
             yearly_results = {}
-            for year in citation_data.keys():
-                if year in pure_f_data:
-                    year_citation = citation_data[year]
-                    year_pure_f = pure_f_data[year]
-                    
-                    di_score = self._calculate_year_di(
-                        year_pure_f,
-                        year_citation,
-                        company,
-                        int(year)
-                    )
-                    if di_score:
-                        yearly_results[year] = di_score
+            # to_dict yields native Python ints/floats, ready for serialization
+            for row in scores.to_dict('records'):
+                yearly_results[str(row['year'])] = {
+                    'company_name': company,
+                    'year': row['year'],
+                    'disruption_index': row['disruption_index'],
+                    'modified_disruption_index': row['modified_disruption_index'],
+                    'components': {
+                        'j5_score': row['j5_score'],
+                        'i5_score': row['i5_score'],
+                        'k5_score': row['k5_score']
+                    },
+                    'metrics': {
+                        'pure_f_score': row['pure_f_score'],
+                        'total_citations': row['total_citations'],
+                        'network_density': row['network_density']
+                    },
+                    'processing_date': self._today
+                }
 
             if not yearly_results:
-                self.logger.error(f"No valid DI results calculated for {company}")
+                self.logger.error("No valid DI results calculated for %s", company)
                 return None
 
             # Save results
-            output_file = self.base_path / company / "disruption_index.json"
-            with open(output_file, 'w') as f:
-                json.dump(yearly_results, f, indent=2)
+            save_json(yearly_results, output_file, pretty=self.pretty)
 
             return yearly_results
 
         except Exception as e:
-            self.logger.error(f"Error calculating DI for {company}: {str(e)}")
+            self.logger.error("Error calculating DI for %s: %s", company, e)
             return None
 
-    def _calculate_year_di(self, pure_f_data: Dict, citation_data: Dict, 
-                         company: str, year: int) -> Optional[Dict]:
-        """Calculate both DI and mDI for a specific year."""
+    def _read_company_di(self, company: str) -> Optional[Dict]:
+        """Read a company's saved disruption_index.json, or None if it is missing."""
+        # Open directly rather than stat first; a missing file is the rare case
         try:
-            # Extract metrics from citation data
-            basic_metrics = citation_data['basic_metrics']
-            temporal_metrics = citation_data['temporal_metrics']
-            network_metrics = citation_data['network_metrics']
-            
-            # Get Pure F score
-            pure_f_score = pure_f_data.get('pure_f_score', 0.0)
-            
-            # Calculate components
-            j5 = self._calculate_j5(basic_metrics, pure_f_score)
-            i5 = self._calculate_i5(temporal_metrics)
-            k5 = self._calculate_k5(network_metrics)
-            
-            # Calculate indices
-            di_score = (j5 + i5 + k5) / 3.0
-            mdi_score = j5 * (1 + i5) * (1 + k5)
-            
-            return {
-                'company_name': company,
-                'year': year,
-                'disruption_index': float(di_score),
-                'modified_disruption_index': float(mdi_score),
-                'components': {
-                    'j5_score': float(j5),
-                    'i5_score': float(i5),
-                    'k5_score': float(k5)
-                },
-                'metrics': {
-                    'pure_f_score': float(pure_f_score),
-                    'total_citations': int(basic_metrics.get('total_citations', 0)),
-                    'network_density': float(network_metrics.get('network_density', 0.0))
-                },
-                'processing_date': datetime.now().strftime('%Y-%m-%d')
-            }
+            return load_json(self.base_path / company / "disruption_index.json")
+        except FileNotFoundError:
+            self.logger.warning("DI summary file not found for %s", company)
+            return None
 
-        except Exception as e:
-            self.logger.error(f"Error in DI calculation: {str(e)}")
+    def _load_pure_f_panel(self) -> Optional[Dict[str, Dict]]:
+        """
+        Read Pure F scores from Data/pure_f_panel.parquet, keyed by company then year.
+        
+        Returns None when the panel has not been written; companies missing from
+        it, or whose pure_f_summary.json is newer than it, fall back to their
+        pure_f_summary.json.
+        """
+        panel_file = self._pure_f_panel_file
+        if not panel_file.exists():
             return None
+        panel = pd.read_parquet(panel_file, columns=['company_name', 'year', 'pure_f_score'])
+        pure_f = {}
+        for company, year, score in zip(panel['company_name'].tolist(), panel['year'].tolist(),
+                                        panel['pure_f_score'].tolist()):
+            pure_f.setdefault(company, {})[str(year)] = {'pure_f_score': score}
+        return pure_f
 
-    def _calculate_j5(self, metrics: Dict, pure_f_score: float) -> float:
+    def _calculate_di_scores(self, citation_data: Dict, pure_f_data: Dict,
+                             company: str) -> pd.DataFrame:
+        """
+        Calculate both DI and mDI for all years of a company in one vectorized pass.
+        
+        Only years present in both inputs are scored; malformed years are
+        logged and skipped.
+        """
+        records = []
+        for year, year_citation in citation_data.items():
+            if year not in pure_f_data:
+                continue
+            missing = [k for k in self.REQUIRED_SECTIONS if k not in year_citation]
+            if missing:
+                self.logger.error("Skipping year %s DI for %s: missing %s",
+                                  year, company, ', '.join(missing))
+                continue
+            basic_metrics = year_citation['basic_metrics']
+            network_metrics = year_citation['network_metrics']
+            records.append((
+                int(year),
+                basic_metrics.get('total_citations', 0),
+                basic_metrics.get('unique_citing_patents', 1),  # avoid div by zero
+                year_citation['temporal_metrics'].get('mean_citation_lag', 0),
+                network_metrics.get('k5_diversity', 0.0),
+                network_metrics.get('network_density', 0.0),
+                pure_f_data[year].get('pure_f_score', 0.0)
+            ))
+        
+        df = pd.DataFrame.from_records(records, columns=self.INPUT_COLUMNS)
+        
+        # Calculate components
+        j5 = self._calculate_j5(
+            df['total_citations'].to_numpy(dtype=np.float64),
+            df['unique_citing_patents'].to_numpy(dtype=np.float64),
+            df['pure_f_score'].to_numpy(dtype=np.float64))
+        i5 = self._calculate_i5(df['mean_citation_lag'].to_numpy(dtype=np.float64))
+        k5 = self._calculate_k5(df['k5_diversity'].to_numpy(dtype=np.float64))
+        
+        # Calculate indices
+        return df.assign(
+            j5_score=j5,
+            i5_score=i5,
+            k5_score=k5,
+            disruption_index=(j5 + i5 + k5) / 3.0,
+            modified_disruption_index=j5 * (1 + i5) * (1 + k5)
+        )
+
+    def _calculate_j5(self, total_citations: np.ndarray, citing_patents: np.ndarray,
+                      pure_f_score: np.ndarray) -> np.ndarray:
         """Calculate forward citation impact score (j5)."""
-        try:
-            total_citations = metrics.get('total_citations', 0)
-            citing_patents = metrics.get('unique_citing_patents', 1)  # avoid div by zero
-            
-            if citing_patents > 0:
-                citation_impact = total_citations / citing_patents
-                return min(1.0, citation_impact * pure_f_score)
-            return 0.0
-        except:
-            return 0.0
+        with np.errstate(divide='ignore', invalid='ignore'):
+            citation_impact = total_citations / citing_patents
+        return np.where(citing_patents > 0, np.minimum(1.0, citation_impact * pure_f_score), 0.0)
 
-    def _calculate_i5(self, temporal_metrics: Dict) -> float:
+    def _calculate_i5(self, mean_lag: np.ndarray) -> np.ndarray:
         """Calculate development speed score (i5)."""
-        try:
-            mean_lag = temporal_metrics.get('mean_citation_lag', 0)
-            if mean_lag > 0:
-                speed_factor = 1.0 / (1.0 + mean_lag/5.0)  # 5-year normalization
-                return min(1.0, speed_factor)
-            return 0.0
-        except:
-            return 0.0
+        # 5-year normalization; no speed score without a positive lag
+        return np.where(mean_lag > 0, np.minimum(1.0, 1.0 / (1.0 + mean_lag / 5.0)), 0.0)
 
-    def _calculate_k5(self, network_metrics: Dict) -> float:
+    def _calculate_k5(self, k5_diversity: np.ndarray) -> np.ndarray:
         """Calculate citation diversity score (k5)."""
-        try:
-            # Use pre-calculated k5 diversity score if available
-            k5_diversity = network_metrics.get('k5_diversity', 0.0)
-            return min(1.0, k5_diversity)
-        except:
-            return 0.0
+        # Use pre-calculated k5 diversity score
+        return np.minimum(1.0, k5_diversity)
 
-    def create_panel_dataset(self, stats: Dict[str, List[str]]) -> None:
+    def create_panel_dataset(self, stats: Dict[str, List[str]],
+                             all_results: Optional[Dict[str, Dict]] = None) -> Optional[pd.DataFrame]:
         """
         Create a panel dataset of Disruption Index scores for all successfully processed companies.
         
         Args:
             stats (Dict[str, List[str]]): Dictionary containing lists of successful and failed companies
+            all_results (Dict[str, Dict], optional): Yearly DI results by company, as returned by
+                calculate_company_di; companies missing here are read from disruption_index.json
+        
+        Returns:
+            pd.DataFrame: The panel as written, or None if it could not be created
         
-        Creates a CSV file with format:
-        company_name, year, disruption_index, pure_f_score, quality_factor, impact_factor, 
-        total_patents, total_citations, citations_per_patent, matched_citations_per_patent
+        Creates Data/disruption_index_panel.parquet and a CSV copy with format:
+        company_name, year, disruption_index, modified_disruption_index, j5_score, i5_score,
+        k5_score, pure_f_score, total_citations, network_density
         
         Example:
-        company_name,year,disruption_index,pure_f_score,quality_factor,impact_factor,...
-        apple,2020,0.65,0.90,0.80,0.90,100,1000,10.0,9.0
-        apple,2021,0.70,0.92,0.85,0.89,120,1200,10.0,9.2
-        boeing,2020,0.55,0.80,0.75,0.92,80,800,10.0,8.0
+        company_name,year,disruption_index,modified_disruption_index,j5_score,...
+        apple,2020,0.65,1.20,0.50,0.60,0.85,0.90,1000,0.02
+        apple,2021,0.70,1.35,0.55,0.62,0.93,0.92,1200,0.03
+        boeing,2020,0.55,0.95,0.40,0.55,0.70,0.80,800,0.01
         ...
         """
         try:
-            panel_data = []
+            # Panel built column-wise, one list per PANEL_COLUMNS entry
+            panel = {column: [] for column in self.PANEL_COLUMNS}
+            
+            # Read results not supplied in memory from disruption_index.json;
+            # the reads are small and I/O-bound, so overlap them on threads
+            all_results = dict(all_results or {})
+            to_read = [company for company in stats['successful'] if company not in all_results]
+            if to_read:
+                with ThreadPoolExecutor(max_workers=min(32, len(to_read))) as executor:
+                    for company, di_data in zip(to_read, executor.map(self._read_company_di, to_read)):
+                        all_results[company] = di_data
             
             # Process each successful company
             for company in stats['successful']:
-                di_file = self.base_path / company / "disruption_index.json"
-                
-                if not di_file.exists():
-                    self.logger.warning(f"DI summary file not found for {company}")
+                di_data = all_results[company]
+                if di_data is None:
                     continue
-                    
-                with open(di_file) as f:
-                    di_data = json.load(f)
                 
                 # Extract yearly data
-                for year, year_data in di_data.items():
-                    row = {
-                        'company_name': company,
-                        'year': year,
-                        'disruption_index': year_data['disruption_index'],
-                        'pure_f_score': year_data['components']['pure_f_score'],
-                        'quality_factor': year_data['components']['quality_factor'],
-                        'impact_factor': year_data['components']['impact_factor'],
-                        'total_patents': year_data['metrics']['total_patents'],
-                        'total_citations': year_data['metrics']['total_citations'],
-                        'citations_per_patent': year_data['metrics']['citations_per_patent'],
-                        'matched_citations_per_patent': year_data['metrics']['matched_citations_per_patent'],
-                        'high_quality_matches': year_data['quality_distribution']['high_quality_matches'],
-                        'medium_quality_matches': year_data['quality_distribution']['medium_quality_matches'],
-                        'low_quality_matches': year_data['quality_distribution']['low_quality_matches'],
-                        'poor_quality_matches': year_data['quality_distribution']['poor_quality_matches']
-                    }
-                    panel_data.append(row)
+                for year_data in di_data.values():
+                    components = year_data['components']
+                    metrics = year_data['metrics']
+                    panel['company_name'].append(company)
+                    panel['year'].append(year_data['year'])  # already an int
+                    panel['disruption_index'].append(year_data['disruption_index'])
+                    panel['modified_disruption_index'].append(year_data['modified_disruption_index'])
+                    panel['j5_score'].append(components['j5_score'])
+                    panel['i5_score'].append(components['i5_score'])
+                    panel['k5_score'].append(components['k5_score'])
+                    panel['pure_f_score'].append(metrics['pure_f_score'])
+                    panel['total_citations'].append(metrics['total_citations'])
+                    panel['network_density'].append(metrics['network_density'])
             
             # Convert to DataFrame and sort
-            df = pd.DataFrame(panel_data)
-            df['year'] = pd.to_numeric(df['year'])
-            df = df.sort_values(['company_name', 'year'])
+            df = pd.DataFrame(panel, columns=self.PANEL_COLUMNS)
+            df.sort_values(['company_name', 'year'], kind='mergesort', ignore_index=True, inplace=True)
+            
+            # Save as Parquet for downstream steps, with CSV kept for reading by hand;
+            # both are written from the same Arrow table
+            table = pa.Table.from_pandas(df, preserve_index=False)
+            pq.write_table(
+                table,
+                self.base_path / "disruption_index_panel.parquet",
+                compression='zstd',
+                use_dictionary=['company_name']
+            )
+            pacsv.write_csv(table, self.base_path / "disruption_index_panel.csv")
             
-            # Save to CSV
-            output_file = self.base_path / "disruption_index_panel.csv"
-            df.to_csv(output_file, index=False)
+            self.logger.info("Created panel dataset with %d observations", len(df))
+            if self.logger.isEnabledFor(logging.INFO):
+                self.logger.info("Companies: %d", df['company_name'].nunique())
+                self.logger.info("Years: %s to %s", df['year'].min(), df['year'].max())
             
-            self.logger.info(f"Created panel dataset with {len(df)} observations")
-            self.logger.info(f"Companies: {df['company_name'].nunique()}")
-            self.logger.info(f"Years: {df['year'].min()} to {df['year'].max()}")
+            return df
             
         except Exception as e:
-            self.logger.error(f"Error creating panel dataset: {str(e)}")
+            self.logger.error("Error creating panel dataset: %s", e)
+            return None
 
 def main():
-    """Process all companies and calculate Disruption Index."""
+    """
+    Process all companies and calculate Disruption Index.
+    
+    Companies whose disruption_index.json is at least as new as both of its
+    inputs are skipped unless --force is given.
+    """
+    parser = argparse.ArgumentParser(description="Calculate Disruption Index scores")
+    parser.add_argument('--force', action='store_true',
+                        help="recalculate companies even if their results are up to date")
+    parser.add_argument('--pretty', action='store_true',
+                        help="indent the JSON output for reading")
+    parser.add_argument('--debug', action='store_true',
+                        help="print each company's first-year input structures")
+    args = parser.parse_args()
+    
     # Initialize calculator with default Data path
-    calculator = DisruptionIndexCalculator()
+    calculator = DisruptionIndexCalculator(force=args.force, pretty=args.pretty, debug=args.debug)
     
     # Get list of companies (directories in Data path)
-    companies = [d.name for d in calculator.base_path.iterdir() 
-                if d.is_dir() and not d.name.startswith('.')
-                and d.name not in ['backup', 'summary']]  # exclude special directories
+    companies = list_companies(calculator.base_path)
     
     print(f"Processing {len(companies)} companies...")
     successful = []
     failed = []
+    all_results = {}
     
-    # Process each company
-    for company in tqdm(companies):
-        if calculator.calculate_company_di(company):
-            successful.append(company)
-            print(f"Successfully processed {company}")
-        else:
-            failed.append(company)
-            print(f"Failed to process {company}")
+    # Workers queue their log records; a listener thread here writes them
+    # through this process's file handler
+    log_queue = multiprocessing.Queue()
+    listener = QueueListener(log_queue, *logging.getLogger(__name__).handlers)
+    listener.start()
+    
+    # Process companies in parallel with one DisruptionIndexCalculator per
+    # worker; each company is fully independent and cheap, so companies are
+    # sent to the workers in chunks
+    process_company = partial(run_company, 'calculate_company_di')
+    try:
+        with ProcessPoolExecutor(max_workers=os.cpu_count(),
+                                 initializer=init_worker,
+                                 initargs=(DisruptionIndexCalculator,
+                                           {'force': calculator.force,
+                                            'pretty': calculator.pretty,
+                                            'debug': calculator.debug},
+                                           log_queue)) as executor:
+            processed = executor.map(process_company, companies, chunksize=8)
+            for company, results in tqdm(processed, total=len(companies)):
+                if results:
+                    successful.append(company)
+                    all_results[company] = results
+                    print(f"Successfully processed {company}")
+                else:
+                    failed.append(company)
+                    print(f"Failed to process {company}")
+    finally:
+        listener.stop()
     
     print(f"\nDisruption Index Calculation Summary")
     print("=" * 50)
@@ -270,6 +392,13 @@ def main():
         print("\nFailed companies:")
         for company in failed:
             print(f"- {company}")
+    
+    # Build the panel from the results already in memory
+    panel = calculator.create_panel_dataset({'successful': successful, 'failed': failed}, all_results)
+    if panel is not None and not panel.empty:
+        print(f"\nPanel dataset: {len(panel)} observations, "
+              f"{panel['company_name'].nunique()} companies, "
+              f"years {panel['year'].min()} to {panel['year'].max()}")
 
 if __name__ == "__main__":
     main()
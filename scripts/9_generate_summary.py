@@ -1,13 +1,21 @@
 import pandas as pd
 import numpy as np
+import orjson
+import argparse
 import logging
+import os
 from pathlib import Path
 from typing import Dict, List, Optional
 import json
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 from tqdm import tqdm
+import matplotlib
+matplotlib.use('Agg')  # figures are only saved to disk
 import matplotlib.pyplot as plt
-import seaborn as sns
+
+# Plots use matplotlib's default style; set it once
+plt.style.use('default')
 
 class SummaryGenerator:
     """
@@ -31,6 +39,16 @@ class SummaryGenerator:
         output_path: Directory for saving generated summaries and visualizations
     """
     
+    # Columns of the panel dataset, in output order
+    PANEL_COLUMNS = ['company_name', 'year', 'disruption_index', 'modified_disruption_index',
+                     'j5_score', 'i5_score', 'k5_score', 'pure_f_score', 'total_citations',
+                     'network_density']
+    # Metric columns averaged per year in yearly_averages.csv
+    NUMERIC_COLS = ['disruption_index', 'modified_disruption_index', 'j5_score', 'i5_score',
+                    'k5_score', 'pure_f_score', 'total_citations', 'network_density']
+    # Years and citation counts fit in 32 bits; scores stay float64
+    INT_COLS = ['year', 'total_citations']
+    
     def __init__(self, base_path: Path = Path("Data")):
         self.base_path = base_path
         # Setup logging
@@ -85,17 +103,22 @@ class SummaryGenerator:
                 self.logger.error(f"DI summary file not found for {company}")
                 return None
                 
-            with open(di_file) as f:
-                di_data = json.load(f)
+            di_data = self._load_json(di_file)
             
             # Calculate aggregate metrics across years
             yearly_data = di_data['yearly_di']
             
-            # Aggregate metrics
-            total_patents = sum(year_data['metrics']['total_patents'] for year_data in yearly_data.values())
-            total_citations = sum(year_data['metrics']['total_citations'] for year_data in yearly_data.values())
-            avg_di = np.mean([year_data['disruption_index'] for year_data in yearly_data.values()])
-            avg_pure_f = np.mean([year_data['components']['pure_f_score'] for year_data in yearly_data.values()])
+            # Aggregate metrics in a single pass over the years
+            total_patents = total_citations = 0
+            sum_di = sum_pure_f = 0.0
+            for year_data in yearly_data.values():
+                total_patents += year_data['metrics']['total_patents']
+                total_citations += year_data['metrics']['total_citations']
+                sum_di += year_data['disruption_index']
+                sum_pure_f += year_data['components']['pure_f_score']
+            n_years = len(yearly_data)
+            avg_di = sum_di / n_years if n_years else float('nan')
+            avg_pure_f = sum_pure_f / n_years if n_years else float('nan')
             
             summary = {
                 'company_name': company,
@@ -218,31 +241,37 @@ class SummaryGenerator:
             - top_companies_di.png
         """
         try:
-            plt.style.use('default')  # Using default style instead of seaborn
-            
             # Average DI Distribution
-            plt.figure(figsize=(12, 6))
-            sns.histplot(data=df, x='average_disruption_index', bins=30)
-            plt.title('Distribution of Average Disruption Index')
-            plt.savefig(self.output_path / 'di_distribution.png')
-            plt.close()
+            fig, ax = plt.subplots(figsize=(12, 6))
+            self._plot_histogram(ax, df['average_disruption_index'], bins=30)
+            ax.set_xlabel('average_disruption_index')
+            ax.set_ylabel('Count')
+            ax.set_title('Distribution of Average Disruption Index')
+            fig.savefig(self.output_path / 'di_distribution.png')
+            plt.close(fig)
             
             # Pure F vs DI
-            plt.figure(figsize=(10, 10))
-            sns.scatterplot(data=df, x='average_pure_f_score', y='average_disruption_index')
-            plt.title('Average Pure F Score vs Average Disruption Index')
-            plt.savefig(self.output_path / 'pure_f_vs_di.png')
-            plt.close()
+            fig, ax = plt.subplots(figsize=(10, 10))
+            ax.scatter(df['average_pure_f_score'].to_numpy(),
+                       df['average_disruption_index'].to_numpy(), s=16)
+            ax.set_xlabel('average_pure_f_score')
+            ax.set_ylabel('average_disruption_index')
+            ax.set_title('Average Pure F Score vs Average Disruption Index')
+            fig.savefig(self.output_path / 'pure_f_vs_di.png')
+            plt.close(fig)
             
             # Top Companies by Average DI
             top_companies = df.nlargest(20, 'average_disruption_index')
-            plt.figure(figsize=(15, 8))
-            sns.barplot(data=top_companies, x='company_name', y='average_disruption_index')
-            plt.xticks(rotation=45, ha='right')
-            plt.title('Top 20 Companies by Average Disruption Index')
-            plt.tight_layout()
-            plt.savefig(self.output_path / 'top_companies_di.png')
-            plt.close()
+            fig, ax = plt.subplots(figsize=(15, 8))
+            ax.bar(top_companies['company_name'].astype(str).to_numpy(),
+                   top_companies['average_disruption_index'].to_numpy())
+            ax.set_xlabel('company_name')
+            ax.set_ylabel('average_disruption_index')
+            plt.setp(ax.get_xticklabels(), rotation=45, ha='right')
+            ax.set_title('Top 20 Companies by Average Disruption Index')
+            fig.tight_layout()
+            fig.savefig(self.output_path / 'top_companies_di.png')
+            plt.close(fig)
             
         except Exception as e:
             self.logger.error(f"Error generating visualizations: {str(e)}", exc_info=True)
@@ -329,43 +358,59 @@ class SummaryGenerator:
 
     def create_panel_dataset(self) -> pd.DataFrame:
         """Creates panel dataset from DI results."""
-        companies = [d.name for d in self.base_path.iterdir() 
-                    if d.is_dir() and not d.name.startswith('.')
-                    and d.name not in ['backup', 'summary']]
-        
-        all_data = []
-        for company in tqdm(companies, desc="Creating panel dataset"):
-            try:
-                di_file = self.base_path / company / "disruption_index.json"
-                if not di_file.exists():
-                    continue
-                    
-                with open(di_file, 'r') as f:
-                    company_data = json.load(f)
-                
-                for year, data in company_data.items():
-                    row = {
-                        'company_name': company,
-                        'year': int(year),
-                        'disruption_index': data['disruption_index'],
-                        'modified_disruption_index': data['modified_disruption_index'],
-                        'j5_score': data['components']['j5_score'],
-                        'i5_score': data['components']['i5_score'],
-                        'k5_score': data['components']['k5_score'],
-                        'pure_f_score': data['metrics']['pure_f_score'],
-                        'total_citations': data['metrics']['total_citations'],
-                        'network_density': data['metrics']['network_density']
-                    }
-                    all_data.append(row)
-                    
-            except Exception as e:
-                self.logger.error(f"Error processing {company}: {str(e)}")
-                continue
-        
-        df = pd.DataFrame(all_data)
+        # One directory walk finds every company that has DI results
+        di_files = [p for p in self.base_path.glob('*/disruption_index.json')
+                    if not p.parent.name.startswith('.')
+                    and p.parent.name not in ['backup', 'summary']]
+        
+        # Company files are small, so loading is dominated by I/O latency;
+        # overlap the reads on a thread pool. The panel is built column-wise,
+        # one list per PANEL_COLUMNS entry
+        panel = {column: [] for column in self.PANEL_COLUMNS}
+        with ThreadPoolExecutor(max_workers=(os.cpu_count() or 1) * 4) as executor:
+            for columns in tqdm(executor.map(self._load_company, di_files),
+                                total=len(di_files), desc="Creating panel dataset"):
+                for column, values in columns.items():
+                    panel[column].extend(values)
+        
+        df = pd.DataFrame(panel, columns=self.PANEL_COLUMNS)
+        df[self.INT_COLS] = df[self.INT_COLS].astype('int32')
         df = df.sort_values(['company_name', 'year'])
         return df
 
+    def _load_json(self, input_file: Path) -> Dict:
+        """Read a JSON file."""
+        return orjson.loads(input_file.read_bytes())
+
+    def _load_company(self, di_file: Path) -> Dict[str, List]:
+        """
+        Load a company's disruption_index.json as panel columns, keyed by
+        PANEL_COLUMNS (empty if the file is invalid).
+        """
+        company = di_file.parent.name
+        try:
+            company_data = self._load_json(di_file)
+            
+            columns = {column: [] for column in self.PANEL_COLUMNS}
+            for year, data in company_data.items():
+                components = data['components']
+                metrics = data['metrics']
+                columns['company_name'].append(company)
+                columns['year'].append(int(year))
+                columns['disruption_index'].append(data['disruption_index'])
+                columns['modified_disruption_index'].append(data['modified_disruption_index'])
+                columns['j5_score'].append(components['j5_score'])
+                columns['i5_score'].append(components['i5_score'])
+                columns['k5_score'].append(components['k5_score'])
+                columns['pure_f_score'].append(metrics['pure_f_score'])
+                columns['total_citations'].append(metrics['total_citations'])
+                columns['network_density'].append(metrics['network_density'])
+            return columns
+            
+        except Exception as e:
+            self.logger.error(f"Error processing {company}: {str(e)}")
+            return {}
+
     def generate_visualizations(self, df: pd.DataFrame):
         """Generates summary visualizations."""
         # Filter out incomplete years (2024)
@@ -374,26 +419,23 @@ class SummaryGenerator:
         output_dir = self.base_path / 'summary' / 'figures'
         output_dir.mkdir(exist_ok=True, parents=True)
         
-        # Set style
-        plt.style.use('default')
+        # A single figure is reused for every plot, cleared and resized in between
+        fig, ax = plt.subplots(figsize=(10, 6))
         
         # 1. DI Distribution (using filtered data)
-        plt.figure(figsize=(10, 6))
-        sns.histplot(data=df_filtered, x='disruption_index', bins=50)
-        plt.title('Distribution of Disruption Index (1836-2023)')
-        plt.xlabel('Disruption Index')
-        plt.ylabel('Count')
-        plt.savefig(output_dir / 'di_distribution.png', dpi=300, bbox_inches='tight')
-        plt.close()
+        self._plot_histogram(ax, df_filtered['disruption_index'], bins=50)
+        ax.set_title('Distribution of Disruption Index (1836-2023)')
+        ax.set_xlabel('Disruption Index')
+        ax.set_ylabel('Count')
+        fig.savefig(output_dir / 'di_distribution.png', dpi=300, bbox_inches='tight')
         
         # 2. mDI Distribution (using filtered data)
-        plt.figure(figsize=(10, 6))
-        sns.histplot(data=df_filtered, x='modified_disruption_index', bins=50)
-        plt.title('Distribution of Modified Disruption Index (1836-2023)')
-        plt.xlabel('Modified Disruption Index')
-        plt.ylabel('Count')
-        plt.savefig(output_dir / 'mdi_distribution.png', dpi=300, bbox_inches='tight')
-        plt.close()
+        ax.clear()
+        self._plot_histogram(ax, df_filtered['modified_disruption_index'], bins=50)
+        ax.set_title('Distribution of Modified Disruption Index (1836-2023)')
+        ax.set_xlabel('Modified Disruption Index')
+        ax.set_ylabel('Count')
+        fig.savefig(output_dir / 'mdi_distribution.png', dpi=300, bbox_inches='tight')
         
         # 3. Time series of average DI and mDI (using filtered data)
         yearly_avg = df_filtered.groupby('year').agg({
@@ -401,55 +443,95 @@ class SummaryGenerator:
             'modified_disruption_index': 'mean'
         }).reset_index()
         
-        plt.figure(figsize=(12, 6))
-        plt.plot(yearly_avg['year'], yearly_avg['disruption_index'], label='DI')
-        plt.plot(yearly_avg['year'], yearly_avg['modified_disruption_index'], label='mDI')
-        plt.title('Average Disruption Indices Over Time (1836-2023)')
-        plt.xlabel('Year')
-        plt.ylabel('Index Value')
-        plt.legend()
+        ax.clear()
+        fig.set_size_inches(12, 6)
+        ax.plot(yearly_avg['year'], yearly_avg['disruption_index'], label='DI')
+        ax.plot(yearly_avg['year'], yearly_avg['modified_disruption_index'], label='mDI')
+        ax.set_title('Average Disruption Indices Over Time (1836-2023)')
+        ax.set_xlabel('Year')
+        ax.set_ylabel('Index Value')
+        ax.legend()
         # Add grid for better readability
-        plt.grid(True, linestyle='--', alpha=0.7)
-        plt.savefig(output_dir / 'di_time_series.png', dpi=300, bbox_inches='tight')
-        plt.close()
-        
-        # 4. Component correlations (using filtered data)
-        plt.figure(figsize=(8, 8))
-        components = ['j5_score', 'i5_score', 'k5_score']
-        corr = df_filtered[components].corr()
-        sns.heatmap(corr, annot=True, cmap='coolwarm', vmin=-1, vmax=1)
-        plt.title('Component Correlations (1836-2023)')
-        plt.savefig(output_dir / 'component_correlations.png', dpi=300, bbox_inches='tight')
-        plt.close()
+        ax.grid(True, linestyle='--', alpha=0.7)
+        fig.savefig(output_dir / 'di_time_series.png', dpi=300, bbox_inches='tight')
+        
+        # 4. Component correlations (using filtered data); drawn last because
+        # the heatmap adds a colorbar axes to the figure. No correlation is
+        # defined for fewer than two rows, so the plot is skipped then
+        if len(df_filtered) >= 2:
+            ax.clear()
+            fig.set_size_inches(8, 8)
+            components = ['j5_score', 'i5_score', 'k5_score']
+            corr = self._correlation_matrix(df_filtered[components].to_numpy(dtype=np.float64))
+            image = ax.imshow(corr, cmap='coolwarm', vmin=-1, vmax=1)
+            fig.colorbar(image, ax=ax)
+            ax.set_xticks(range(len(components)))
+            ax.set_xticklabels(components)
+            ax.set_yticks(range(len(components)))
+            ax.set_yticklabels(components)
+            for i in range(len(components)):
+                for j in range(len(components)):
+                    ax.text(j, i, f'{corr[i, j]:.2g}', ha='center', va='center')
+            ax.set_title('Component Correlations (1836-2023)')
+            fig.savefig(output_dir / 'component_correlations.png', dpi=300, bbox_inches='tight')
+        plt.close(fig)
+
+    def _correlation_matrix(self, arr: np.ndarray) -> np.ndarray:
+        """
+        Pearson correlations between the columns of arr, like DataFrame.corr().
+        
+        Each pair uses every row where both columns are present; pairs with
+        fewer than two such rows or a constant column are NaN.
+        """
+        n = arr.shape[1]
+        present = ~np.isnan(arr)
+        corr = np.full((n, n), np.nan)
+        # Constant columns (e.g. i5_score while lags are zero) divide by zero
+        with np.errstate(divide='ignore', invalid='ignore'):
+            for i in range(n):
+                for j in range(i, n):
+                    rows = present[:, i] & present[:, j]
+                    if rows.sum() >= 2:
+                        corr[i, j] = corr[j, i] = np.corrcoef(arr[rows, i], arr[rows, j])[0, 1]
+        return corr
 
-    def generate_summary(self):
-        """Generates comprehensive summary reports and visualizations."""
-        # Create panel dataset
+    def _plot_histogram(self, ax, values: pd.Series, bins: int):
+        """Draw a frequency histogram of the finite values in a column, one bar per bin."""
+        arr = values.to_numpy(dtype=np.float64)
+        arr = arr[np.isfinite(arr)]
+        if arr.size == 0:
+            return
+        counts, edges = np.histogram(arr, bins=bins, range=(arr.min(), arr.max()))
+        ax.bar(edges[:-1], counts, width=np.diff(edges), align='edge', edgecolor='black')
+
+    def generate_summary(self, write_csv: bool = False):
+        """
+        Generates comprehensive summary reports and visualizations.
+        
+        The panel is written as Parquet; set write_csv to also write a CSV copy.
+        """
+        # Create panel dataset; company names repeat once per year, so store
+        # them as a categorical (dictionary-encoded in Parquet)
         df = self.create_panel_dataset()
+        df['company_name'] = df['company_name'].astype('category')
         
         # Create output directory
         output_dir = self.base_path / 'summary'
         output_dir.mkdir(exist_ok=True)
         
         # Save panel data
-        df.to_parquet(output_dir / 'disruption_panel.parquet', index=False)
-        df.to_csv(output_dir / 'disruption_panel.csv', index=False)
+        df.to_parquet(output_dir / 'disruption_panel.parquet', index=False, compression='zstd')
+        if write_csv:
+            with open(output_dir / 'disruption_panel.csv', 'w', newline='',
+                      buffering=1 << 20) as f:
+                df.to_csv(f, index=False, chunksize=100_000)
         
         # Generate summary statistics
         summary_stats = df.describe()
         summary_stats.to_csv(output_dir / 'disruption_summary_stats.csv')
         
         # Generate yearly averages
-        yearly_avg = df.groupby('year').agg({
-            'disruption_index': 'mean',
-            'modified_disruption_index': 'mean',
-            'j5_score': 'mean',
-            'i5_score': 'mean',
-            'k5_score': 'mean',
-            'pure_f_score': 'mean',
-            'total_citations': 'mean',
-            'network_density': 'mean'
-        }).round(4)
+        yearly_avg = df.groupby('year', sort=True)[self.NUMERIC_COLS].mean().round(4)
         
         yearly_avg.to_csv(output_dir / 'yearly_averages.csv')
         
@@ -465,8 +547,13 @@ class SummaryGenerator:
 
 def main():
     """Generate comprehensive summary."""
+    parser = argparse.ArgumentParser(description="Generate summary reports and visualizations")
+    parser.add_argument('--csv', action='store_true',
+                        help="also write the panel dataset as CSV")
+    args = parser.parse_args()
+    
     generator = SummaryGenerator()
-    df = generator.generate_summary()
+    df = generator.generate_summary(write_csv=args.csv)
     
     print("\nSummary Generation Complete")
     print("=" * 50)
@@ -475,7 +562,8 @@ def main():
     print(f"Year range: {df.year.min()} - {df.year.max()}")
     print("\nOutput files created in Data/summary/:")
     print("- disruption_panel.parquet")
-    print("- disruption_panel.csv")
+    if args.csv:
+        print("- disruption_panel.csv")
     print("- disruption_summary_stats.csv")
     print("- yearly_averages.csv")
     print("\nVisualizations created in Data/summary/figures/:")
@@ -1,9 +1,39 @@
 import os
+import csv
 from pathlib import Path
-import pandas as pd
 from collections import defaultdict
 import json
 
+def read_csv_header(path):
+    """
+    Read the column names of a CSV file the way pd.read_csv(path, nrows=0)
+    reports them: blank lines before the header are skipped, blank names
+    become 'Unnamed: N' and repeated names get '.1', '.2', ... suffixes
+    """
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        header = next((row for row in csv.reader(f)
+                       if not (len(row) <= 1 and ''.join(row).strip() == '')), None)
+    if header is None:
+        raise ValueError("No columns to parse from file")
+    
+    columns = [name if name else f"Unnamed: {i}" for i, name in enumerate(header)]
+    # Given names keep priority over generated ones when deduplicating
+    unnamed = [i for i, name in enumerate(header) if not name]
+    named = [i for i, name in enumerate(header) if name]
+    counts = {}
+    for i in named + unnamed:
+        name = columns[i]
+        count = counts.get(name, 0)
+        if count > 0:
+            base = name
+            while count > 0:
+                counts[base] = count + 1
+                name = f"{base}.{count}"
+                count = count + 1 if name in columns else counts.get(name, 0)
+            columns[i] = name
+        counts[name] = count + 1
+    return columns
+
 def analyze_data_folder(base_path):
     """
     Analyze the Data folder structure and file patterns
@@ -20,12 +50,14 @@ def analyze_data_folder(base_path):
             'files': [],
             'folders': [],
             'file_patterns': set(),
-            'csv_columns': defaultdict(set)
+            'csv_columns': {}  # relative file path -> header column list
         }
         
-        # Analyze folder structure
-        for root, dirs, files in os.walk(company_folder):
-            rel_path = Path(root).relative_to(company_folder)
+        # Analyze folder structure (os.walk lists directories with scandir;
+        # paths stay plain strings)
+        company_dir = str(company_folder)
+        for root, dirs, files in os.walk(company_dir):
+            rel_path = os.path.relpath(root, company_dir)
             
             # Store folders
             if dirs:
@@ -34,15 +66,14 @@ def analyze_data_folder(base_path):
             # Analyze files
             for file in files:
                 if file.endswith('.csv'):
-                    full_path = Path(root) / file
-                    rel_file_path = full_path.relative_to(company_folder)
-                    structure[company_name]['files'].append(str(rel_file_path))
-                    structure[company_name]['file_patterns'].add(file.split('_')[0] if '_' in file else file)
+                    full_path = os.path.join(root, file)
+                    rel_file_path = os.path.normpath(os.path.join(rel_path, file))
+                    structure[company_name]['files'].append(rel_file_path)
+                    structure[company_name]['file_patterns'].add(file.split('_', 1)[0])
                     
-                    # Sample CSV columns (reading just header)
+                    # Sample CSV columns (reading just the header line)
                     try:
-                        df = pd.read_csv(full_path, nrows=0)
-                        structure[company_name]['csv_columns'][str(rel_file_path)] = list(df.columns)
+                        structure[company_name]['csv_columns'][rel_file_path] = read_csv_header(full_path)
                     except Exception as e:
                         print(f"Error reading {full_path}: {str(e)}")
     
@@ -3,7 +3,12 @@ import re
 import os
 from pathlib import Path
 import shutil
+from functools import lru_cache
 
+# Number ranges in file names, e.g. "2000 - 2010"
+NUMRANGE = re.compile(r'(\d+)\s*-\s*(\d+)')
+
+@lru_cache(maxsize=None)
 def clean_name(name):
     """Standardize name format"""
     return name.lower().replace(' ', '_').replace('&', 'and')
@@ -16,6 +21,8 @@ def clean_schema_and_folders(schema_path, base_data_path):
     base_path = Path(base_data_path)
     changes_made = []
     errors = []
+    # Cleaned CSV names seen while renaming, for expected_files
+    all_files = set()
 
     # 1. Clean schema first
     schema['required_folders'] = [
@@ -28,11 +35,12 @@ def clean_schema_and_folders(schema_path, base_data_path):
         clean_name(company) for company in schema['config']['companies']
     ]
 
-    # 3. Process each company folder
-    for company_folder in base_path.glob('*'):
-        if not company_folder.is_dir():
-            continue
-            
+    # 3. Process each company folder (scandir entries carry their file type,
+    # so no extra stat per entry)
+    with os.scandir(base_path) as entries:
+        company_folders = [Path(entry.path) for entry in entries if entry.is_dir()]
+
+    for company_folder in company_folders:
         old_name = company_folder.name
         new_name = clean_name(old_name)
         
@@ -64,24 +72,23 @@ def clean_schema_and_folders(schema_path, base_data_path):
             for csv_file in company_folder.rglob('*.csv'):
                 old_file_name = csv_file.name
                 # Standardize number range format in filenames
-                new_file_name = re.sub(r'(\d+)\s*-\s*(\d+)', r'\1_\2', old_file_name)
+                new_file_name = NUMRANGE.sub(r'\1_\2', old_file_name)
                 new_file_name = clean_name(new_file_name)
                 
                 if old_file_name != new_file_name:
                     new_file_path = csv_file.parent / new_file_name
                     csv_file.rename(new_file_path)
                     changes_made.append(f"Renamed file in {new_name}: {old_file_name} -> {new_file_name}")
+                all_files.add(new_file_name)
 
         except Exception as e:
             errors.append(f"Error processing {old_name}: {str(e)}")
-
-    # 4. Update expected_files in schema based on actual files
-    all_files = set()
-    for company_folder in base_path.glob('*'):
-        if company_folder.is_dir():
+            # Some CSVs may not have been reached; list the folder's files
+            # under their names on disk, as a full rescan would
             for csv_file in company_folder.rglob('*.csv'):
                 all_files.add(clean_name(csv_file.name))
-    
+
+    # 4. Update expected_files in schema based on the files renamed above
     schema['expected_files'] = sorted(list(all_files))
 
     return schema, changes_made, errors
@@ -0,0 +1,87 @@
+import orjson
+import logging
+import multiprocessing
+import os
+from logging.handlers import QueueHandler
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+# Shared helpers for the per-company steps (6_count_flags, 7_calculate_pure_f
+# and 8_calculate_di)
+
+# Directories in the data path that do not hold a company
+SPECIAL_DIRS = {'backup', 'summary'}
+
+# Loggers that already have their handler, so repeated instances (one per
+# worker) don't each add another
+_CONFIGURED_LOGGERS: Set[str] = set()
+
+def configure_logging(name: str, log_file: Optional[str] = None,
+                      log_queue: Optional[multiprocessing.Queue] = None) -> logging.Logger:
+    """
+    Attach a file handler for log_file to the named logger once.
+
+    Worker processes pass log_queue instead: their records are queued for the
+    main process's QueueListener, which is then the only writer of the file.
+    """
+    logger = logging.getLogger(name)
+    if log_queue is not None:
+        logger.handlers = [QueueHandler(log_queue)]  # replaces any handler inherited by fork
+        logger.setLevel(logging.INFO)
+        _CONFIGURED_LOGGERS.add(name)
+        return logger
+    if name in _CONFIGURED_LOGGERS:
+        return logger
+    Path(log_file).parent.mkdir(exist_ok=True)
+    handler = logging.FileHandler(log_file)
+    handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+    _CONFIGURED_LOGGERS.add(name)
+    return logger
+
+def up_to_date(output: Path, inputs: Iterable[Path]) -> bool:
+    """True when output exists and is at least as new as every input."""
+    try:
+        output_mtime = output.stat().st_mtime
+    except FileNotFoundError:
+        return False
+    return all(output_mtime >= p.stat().st_mtime for p in inputs)
+
+def load_json(input_file: Path) -> Dict:
+    """Read a JSON file."""
+    return orjson.loads(input_file.read_bytes())
+
+def save_json(data: Dict, output_file: Path, pretty: bool = False) -> None:
+    """Write data as JSON, indented when pretty is set."""
+    option = orjson.OPT_SERIALIZE_NUMPY
+    if pretty:
+        option |= orjson.OPT_INDENT_2
+    output_file.write_bytes(orjson.dumps(data, option=option))
+
+def list_companies(base_path: Path) -> List[str]:
+    """Names of the company directories in base_path."""
+    # scandir entries answer is_dir from the directory listing, without a stat per entry
+    with os.scandir(base_path) as entries:
+        return [e.name for e in entries
+                if e.is_dir() and not e.name.startswith('.') and e.name not in SPECIAL_DIRS]
+
+# Processor owned by the current worker process (see init_worker)
+_worker: Any = None
+
+def init_worker(factory: Callable[..., Any], kwargs: Dict[str, Any],
+                log_queue: Optional[multiprocessing.Queue] = None) -> None:
+    """
+    Create a single processor per worker process with factory(**kwargs).
+
+    With log_queue, the factory's module logger is routed to the main process
+    first.
+    """
+    global _worker
+    if log_queue is not None:
+        configure_logging(factory.__module__, log_queue=log_queue)
+    _worker = factory(**kwargs)
+
+def run_company(method: str, company: str) -> Tuple[str, Any]:
+    """Call the worker's processor method for one company and return (company, result)."""
+    return company, getattr(_worker, method)(company)